@@ -0,0 +1,321 @@
+import os
+import zlib
+import gzip
+import json
+import heapq
+import itertools
+from datetime import datetime
+from bson import json_util
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OUTPUT_DIR = os.getenv("CDC_OUTPUT_DIR", "cdc")
+# Remove os segmentos depois de incorporados ao snapshot
+PRUNE = os.getenv("CDC_COMPACT_PRUNE", "false").lower() in ("1", "true", "yes")
+# Quantos deltas acumular antes de reescrever a base
+MAX_DELTAS = int(os.getenv("CDC_COMPACT_MAX_DELTAS", "10"))
+# Documentos mantidos em memória antes de descarregar um run ordenado em disco
+RUN_SIZE = int(os.getenv("CDC_COMPACT_RUN_SIZE", "50000"))
+
+COLLECTIONS = ["customers", "products", "carts", "orders", "reviews", "payments"]
+
+# Registros do exportador que zeram o estado da coleção: o início de um
+# baseline e o drop/rename da coleção
+BASELINE_START = "baseline_start"
+COLLECTION_RESET = "collection_reset"
+RESET_OPERATIONS = (BASELINE_START, COLLECTION_RESET)
+FILE_TS_FORMAT = "%Y%m%dT%H%M%S%f"
+READ_CHUNK = 1 << 16
+
+_file_seq = itertools.count()
+
+
+class CorruptSegment(Exception):
+    """Membro gzip incompleto ou inválido a partir de ``offset``."""
+
+    def __init__(self, path: str, offset: int):
+        super().__init__(f"{path}: segmento corrompido a partir do byte {offset}")
+        self.path = path
+        self.offset = offset
+
+
+class CorruptSnapshot(Exception):
+    """Base ou delta ilegível (p.ex. gravação perdida numa queda de energia)."""
+
+    def __init__(self, path: str, error: Exception):
+        super().__init__(
+            f"{path}: snapshot ilegível ({error}). Refaça o baseline: pare o "
+            f"exportador, apague {os.path.join(OUTPUT_DIR, '_resume_token.json')} "
+            "e inicie-o de novo; a próxima compactação recria a base."
+        )
+        self.path = path
+
+
+def fsync_dir(path: str):
+    # Persiste a entrada de diretório criada por os.replace
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def iter_members(path: str):
+    # Percorre o arquivo membro a membro, devolvendo (offset final, conteúdo);
+    # um membro truncado ou inválido levanta CorruptSegment no seu início
+    with open(path, "rb") as f:
+        start, consumed = 0, 0
+        decomp, out = zlib.decompressobj(wbits=31), []
+        while True:
+            data = f.read(READ_CHUNK)
+            if not data:
+                break
+            while data:
+                try:
+                    out.append(decomp.decompress(data))
+                except zlib.error:
+                    raise CorruptSegment(path, start)
+                if not decomp.eof:
+                    consumed += len(data)
+                    break
+                consumed += len(data) - len(decomp.unused_data)
+                start += consumed
+                yield start, b"".join(out)
+                data = decomp.unused_data
+                consumed, decomp, out = 0, zlib.decompressobj(wbits=31), []
+        if consumed:
+            raise CorruptSegment(path, start)
+
+
+def read_events(path: str):
+    try:
+        for _, payload in iter_members(path):
+            for line in payload.decode("utf-8").splitlines():
+                if line.strip():
+                    yield json_util.loads(line)
+    except CorruptSegment as e:
+        # Eventos após o ponto corrompido não são recuperáveis; os não
+        # confirmados no checkpoint são reenviados pelo exportador
+        print(f"[WARN] {e}; restante do segmento ignorado")
+
+
+def read_ndjson_gz(path: str):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line)
+    except (OSError, EOFError, zlib.error, ValueError) as e:
+        raise CorruptSnapshot(path, e) from e
+
+
+def write_ndjson_gz(path: str, docs):
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as gz:
+            for doc in docs:
+                line = json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS)
+                gz.write((line + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(path))
+
+
+def doc_key(_id) -> str:
+    return json_util.dumps(_id)
+
+
+def snapshot_dir(name: str) -> str:
+    return os.path.join(OUTPUT_DIR, "snapshots", name)
+
+
+def new_file_name(name: str, prefix: str) -> str:
+    # O sequencial evita colisão entre arquivos criados no mesmo microssegundo
+    stamp = datetime.utcnow().strftime(FILE_TS_FORMAT)
+    return f"{prefix}-{stamp}-{next(_file_seq):06d}.ndjson.gz"
+
+
+def load_manifest(name: str) -> dict:
+    # base: snapshot completo ordenado por chave; deltas: mudanças posteriores,
+    # na ordem em que foram gerados; segments: segmentos já incorporados
+    path = os.path.join(snapshot_dir(name), "manifest.json")
+    if not os.path.exists(path):
+        return {"base": None, "deltas": [], "segments": []}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(name: str, manifest: dict):
+    path = os.path.join(snapshot_dir(name), "manifest.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+    fsync_dir(snapshot_dir(name))
+
+
+def write_run(name: str, changes: dict) -> str:
+    run = new_file_name(name, "run")
+    ordered = sorted(changes.items())
+    records = ({"key": raw_key, "doc": doc} for _, (raw_key, doc) in ordered)
+    write_ndjson_gz(os.path.join(snapshot_dir(name), run), records)
+    return run
+
+
+def fold_events(name: str, events) -> tuple:
+    # Acumula as mudanças por chave (doc None = removido) e, a cada RUN_SIZE
+    # chaves, descarrega um run ordenado em disco. A memória fica limitada a
+    # RUN_SIZE documentos mesmo quando os pendentes contêm um baseline inteiro;
+    # os runs depois são combinados pelo merge k-way de merge_records.
+    changes, runs, reset, touched = {}, [], False, 0
+    for event in events:
+        if event["op"] in RESET_OPERATIONS:
+            for run in runs:
+                os.remove(os.path.join(snapshot_dir(name), run))
+            changes, runs, reset, touched = {}, [], True, 0
+            continue
+        key = doc_key(event["key"])
+        if event["op"] == "delete":
+            changes[key] = (event["key"], None)
+        elif event.get("doc") is not None:
+            # updateLookup pode trazer doc nulo se houve delete depois; o delete vem a seguir
+            changes[key] = (event["key"], event["doc"])
+        if len(changes) >= RUN_SIZE:
+            runs.append(write_run(name, changes))
+            touched += len(changes)
+            changes = {}
+    if changes:
+        runs.append(write_run(name, changes))
+        touched += len(changes)
+    return runs, reset, touched
+
+
+def iter_base(path: str):
+    for doc in read_ndjson_gz(path):
+        yield doc_key(doc["_id"]), {"key": doc["_id"], "doc": doc}
+
+
+def iter_records(path: str):
+    # Deltas e runs: registros {"key", "doc"} ordenados por chave
+    for record in read_ndjson_gz(path):
+        yield doc_key(record["key"]), record
+
+
+def tag(source, priority: int):
+    for key, record in source:
+        yield key, priority, record
+
+
+def merge_records(sources: list):
+    # Merge k-way em streaming de fontes ordenadas por chave; para a mesma
+    # chave vence a fonte mais recente (maior prioridade)
+    tagged = [tag(source, priority) for priority, source in enumerate(sources)]
+    merged = heapq.merge(*tagged, key=lambda item: (item[0], item[1]))
+    for _, group in itertools.groupby(merged, key=lambda item: item[0]):
+        *_, (_, _, record) = group
+        yield record
+
+
+def live_docs(records):
+    return (record["doc"] for record in records if record["doc"] is not None)
+
+
+def iter_snapshot(name: str, manifest: dict = None):
+    # Estado atual (base + deltas) em streaming, ordenado por chave
+    manifest = manifest or load_manifest(name)
+    directory = snapshot_dir(name)
+    sources = []
+    if manifest["base"]:
+        sources.append(iter_base(os.path.join(directory, manifest["base"])))
+    for delta in manifest["deltas"]:
+        sources.append(iter_records(os.path.join(directory, delta)))
+    return live_docs(merge_records(sources))
+
+
+def rebuild_base(name: str, manifest: dict) -> dict:
+    base = new_file_name(name, "base")
+    write_ndjson_gz(
+        os.path.join(snapshot_dir(name), base), iter_snapshot(name, manifest)
+    )
+    return {**manifest, "base": base, "deltas": []}
+
+
+def remove_unreferenced(name: str, manifest: dict):
+    # Também limpa órfãos deixados por uma compactação interrompida
+    keep = {manifest["base"], *manifest["deltas"]}
+    for file_name in os.listdir(snapshot_dir(name)):
+        if file_name.startswith(("base-", "delta-", "run-")) and file_name not in keep:
+            os.remove(os.path.join(snapshot_dir(name), file_name))
+
+
+def compact_collection(name: str):
+    directory = os.path.join(OUTPUT_DIR, name)
+    if not os.path.isdir(directory):
+        print(f"[INFO] Sem segmentos para: {name}")
+        return
+
+    os.makedirs(snapshot_dir(name), exist_ok=True)
+    manifest = load_manifest(name)
+    # Apenas segmentos fechados; o nome carrega o timestamp e garante a ordem
+    pending = sorted(
+        s
+        for s in os.listdir(directory)
+        if s.endswith(".ndjson.gz") and s not in manifest["segments"]
+    )
+    if not pending:
+        print(f"[INFO] Nada a compactar em: {name}")
+        return
+
+    runs, reset, touched = fold_events(
+        name,
+        (
+            event
+            for segment in pending
+            for event in read_events(os.path.join(directory, segment))
+        ),
+    )
+    folded = merge_records(
+        [iter_records(os.path.join(snapshot_dir(name), run)) for run in runs]
+    )
+    segments = manifest["segments"] + pending
+    if reset:
+        # Reset no meio dos pendentes: base nova, anteriores descartados
+        base = new_file_name(name, "base")
+        write_ndjson_gz(os.path.join(snapshot_dir(name), base), live_docs(folded))
+        updated = {"base": base, "deltas": [], "segments": segments}
+    else:
+        delta = new_file_name(name, "delta")
+        write_ndjson_gz(os.path.join(snapshot_dir(name), delta), folded)
+        updated = {
+            "base": manifest["base"],
+            "deltas": manifest["deltas"] + [delta],
+            "segments": segments,
+        }
+        if len(updated["deltas"]) > MAX_DELTAS:
+            updated = rebuild_base(name, updated)
+
+    # Arquivos novos primeiro, manifesto depois, remoções por último: uma queda
+    # no meio deixa no máximo arquivos órfãos, nunca um manifesto inválido
+    save_manifest(name, updated)
+    remove_unreferenced(name, updated)
+    if PRUNE:
+        for segment in pending:
+            os.remove(os.path.join(directory, segment))
+    print(
+        f"[OK] {name}: {len(pending)} segmentos, {touched} alterações"
+        f"{' (baseline)' if reset else ''}, {len(updated['deltas'])} deltas pendentes"
+    )
+
+
+def main():
+    print(f"Compactando segmentos CDC em {OUTPUT_DIR}")
+    for name in COLLECTIONS:
+        compact_collection(name)
+    print(f"\n✅ Snapshots atualizados em {os.path.join(OUTPUT_DIR, 'snapshots')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import os
+import time
+import gzip
+from datetime import datetime
+from bson import json_util
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+from cdc_compact import BASELINE_START, COLLECTION_RESET, fsync_dir
+
+load_dotenv()
+
+# Change streams exigem replica set (ver docker-compose.rs.yml para um nó local)
+MONGO_URI = os.getenv("CDC_MONGO_URI", "mongodb://localhost:27018/?replicaSet=rs0")
+DB_NAME = os.getenv("MONGO_DB", "amazonas-db-v2")
+
+OUTPUT_DIR = os.getenv("CDC_OUTPUT_DIR", "cdc")
+# Rotação de segmentos por tamanho (bytes comprimidos) ou por idade (segundos)
+MAX_SEGMENT_BYTES = int(os.getenv("CDC_MAX_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+MAX_SEGMENT_SECONDS = int(os.getenv("CDC_MAX_SEGMENT_SECONDS", "3600"))
+# Gravação em disco em lotes: por quantidade de eventos ou por intervalo
+BATCH_SIZE = int(os.getenv("CDC_BATCH_SIZE", "500"))
+FLUSH_SECONDS = float(os.getenv("CDC_FLUSH_SECONDS", "5"))
+
+client = MongoClient(MONGO_URI)
+db = client[DB_NAME]
+
+COLLECTIONS = ["customers", "products", "carts", "orders", "reviews", "payments"]
+DOCUMENT_OPERATIONS = ["insert", "update", "replace", "delete"]
+
+SEGMENT_TS_FORMAT = "%Y%m%dT%H%M%S%f"
+PART_SUFFIX = ".part"
+# Código do servidor quando o resume token já saiu do oplog
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def token_path() -> str:
+    return os.path.join(OUTPUT_DIR, "_resume_token.json")
+
+
+def to_line(record: dict) -> bytes:
+    return (
+        json_util.dumps(record, json_options=json_util.RELAXED_JSON_OPTIONS) + "\n"
+    ).encode("utf-8")
+
+
+def write_atomic(path: str, data: str):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    fsync_dir(os.path.dirname(path))
+
+
+def load_checkpoint():
+    # Checkpoint: posição no stream (resume token ou operationTime do baseline)
+    # e o offset confirmado de cada segmento ativo
+    if not os.path.exists(token_path()):
+        return None
+    with open(token_path(), encoding="utf-8") as f:
+        return json_util.loads(f.read())
+
+
+def save_checkpoint(position: dict, writers: dict):
+    checkpoint = {
+        **position,
+        "segments": {name: writer.state() for name, writer in writers.items()},
+    }
+    write_atomic(token_path(), json_util.dumps(checkpoint))
+
+
+def stream_position(checkpoint: dict) -> dict:
+    if "resume_token" in checkpoint:
+        return {"resume_token": checkpoint["resume_token"]}
+    return {"start_at_operation_time": checkpoint["start_at_operation_time"]}
+
+
+class SegmentWriter:
+    """Segmentos NDJSON gzip de uma coleção, rotacionados por tamanho/idade.
+
+    O segmento ativo termina em ``.part``; ao rotacionar ele é renomeado e
+    passa a ser visível para a compactação (ver cdc_compact.py). Ao retomar,
+    o ``.part`` é truncado no offset confirmado pelo checkpoint: bytes além
+    dele (inclusive um membro gzip pela metade) não foram confirmados e serão
+    reenviados pelo stream.
+    """
+
+    def __init__(self, collection: str, committed: dict = None):
+        self.directory = os.path.join(OUTPUT_DIR, collection)
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = None
+        self.started_at = None
+        self.offset = 0
+        committed = committed or {}
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(PART_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            offset = committed.get("offset", 0) if name == committed.get("name") else 0
+            if offset == 0:
+                os.remove(path)
+                print(f"[WARN] Segmento não confirmado descartado: {path}")
+                continue
+            if os.path.getsize(path) > offset:
+                print(f"[WARN] Truncando {path} no byte confirmado {offset}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+            self.path, self.offset = path, offset
+            stamp = name[len("segment-") : -len(".ndjson.gz" + PART_SUFFIX)]
+            self.started_at = datetime.strptime(stamp, SEGMENT_TS_FORMAT)
+
+    def state(self):
+        if self.path is None:
+            return None
+        return {"name": os.path.basename(self.path), "offset": self.offset}
+
+    def append(self, lines: list[bytes]):
+        if not lines:
+            return
+        if self.path is None:
+            self.started_at = datetime.utcnow()
+            name = f"segment-{self.started_at.strftime(SEGMENT_TS_FORMAT)}.ndjson.gz"
+            self.path = os.path.join(self.directory, name + PART_SUFFIX)
+            self.offset = 0
+        # Cada lote vira um membro gzip a mais no arquivo (gzip aceita concatenação)
+        with open(self.path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab") as gz:
+                gz.write(b"".join(lines))
+            raw.flush()
+            os.fsync(raw.fileno())
+            self.offset = raw.tell()
+
+    def should_rotate(self) -> bool:
+        if self.path is None:
+            return False
+        age = (datetime.utcnow() - self.started_at).total_seconds()
+        return self.offset >= MAX_SEGMENT_BYTES or age >= MAX_SEGMENT_SECONDS
+
+    def rotate(self):
+        if self.path is None:
+            return
+        os.replace(self.path, self.path[: -len(PART_SUFFIX)])
+        fsync_dir(self.directory)
+        print(f"[OK] Segmento fechado: {self.path[: -len(PART_SUFFIX)]}")
+        self.path = None
+        self.started_at = None
+        self.offset = 0
+
+
+def flush(writers: dict, buffers: dict, position: dict, close: bool = False):
+    # Dados primeiro, checkpoint depois: uma queda reenvia eventos, nunca os perde
+    for name, lines in buffers.items():
+        writers[name].append(lines)
+        lines.clear()
+    for writer in writers.values():
+        if close or writer.should_rotate():
+            writer.rotate()
+    save_checkpoint(position, writers)
+
+
+def change_to_record(change: dict) -> dict:
+    return {
+        "coll": change["ns"]["coll"],
+        "op": change["operationType"],
+        "key": change["documentKey"]["_id"],
+        "ts": change["clusterTime"],
+        "doc": change.get("fullDocument"),
+    }
+
+
+def handle_change(change: dict, buffers: dict) -> bool:
+    # Enfileira o evento; devolve True quando só um novo baseline recupera o estado
+    op = change["operationType"]
+    if op in DOCUMENT_OPERATIONS:
+        record = change_to_record(change)
+        buffers[record["coll"]].append(to_line(record))
+        return False
+    if op in ("drop", "rename") and change["ns"]["coll"] in buffers:
+        # A coleção deixou de existir sob esse nome: o snapshot dela zera
+        buffers[change["ns"]["coll"]].append(
+            to_line(
+                {
+                    "coll": change["ns"]["coll"],
+                    "op": COLLECTION_RESET,
+                    "ts": change["clusterTime"],
+                }
+            )
+        )
+    # rename para uma coleção monitorada troca todo o conteúdo dela sem eventos
+    # por documento; invalidate (dropDatabase/renameDatabase) encerra o stream
+    return op == "invalidate" or (
+        op == "rename" and change.get("to", {}).get("coll") in buffers
+    )
+
+
+def baseline(writers: dict) -> dict:
+    # Carga inicial sem lacunas: captura o operationTime antes da varredura e
+    # inicia o stream a partir dele; eventos repetidos são absorvidos na compactação.
+    # O marcador baseline_start faz a compactação descartar o estado anterior,
+    # então documentos removidos antes de um novo baseline não sobram no snapshot.
+    # Os segmentos só são fechados ao final, para que um baseline interrompido
+    # nunca fique visível à compactação.
+    op_time = db.command("ping")["operationTime"]
+    print(f"[INFO] Baseline a partir de {op_time}")
+    for name in COLLECTIONS:
+        lines, count = [to_line({"coll": name, "op": BASELINE_START, "ts": op_time})], 0
+        for doc in db[name].find({}):
+            lines.append(
+                to_line(
+                    {
+                        "coll": name,
+                        "op": "snapshot",
+                        "key": doc["_id"],
+                        "ts": op_time,
+                        "doc": doc,
+                    }
+                )
+            )
+            if len(lines) >= BATCH_SIZE:
+                writers[name].append(lines)
+                count += len(lines)
+                lines = []
+        writers[name].append(lines)
+        count += len(lines)
+        print(f"[OK] Baseline {name}: {count - 1} documentos")
+    position = {"start_at_operation_time": op_time}
+    flush(writers, {}, position, close=True)
+    return position
+
+
+def stream_changes(writers: dict, position: dict) -> bool:
+    # Devolve True quando o stream exige um novo baseline
+    needs_baseline = False
+    if "resume_token" in position:
+        print("[INFO] Retomando a partir do resume token salvo")
+    buffers = {name: [] for name in COLLECTIONS}
+    pipeline = [
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": "invalidate"},
+                    {
+                        "operationType": {
+                            "$in": DOCUMENT_OPERATIONS + ["drop", "rename"]
+                        },
+                        "ns.coll": {"$in": COLLECTIONS},
+                    },
+                    {"operationType": "rename", "to.coll": {"$in": COLLECTIONS}},
+                ]
+            }
+        }
+    ]
+    watch_options = {
+        "resume_after" if key == "resume_token" else key: value
+        for key, value in position.items()
+    }
+    pending, last_flush = 0, time.monotonic()
+    try:
+        with db.watch(
+            pipeline,
+            full_document="updateLookup",
+            max_await_time_ms=1000,
+            **watch_options,
+        ) as stream:
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    pending += 1
+                    if handle_change(change, buffers):
+                        # Não avança a posição: o token de um invalidate não
+                        # serve para retomar, e o baseline grava a nova posição
+                        print(
+                            f"[WARN] Evento {change['operationType']} exige novo baseline"
+                        )
+                        needs_baseline = True
+                        break
+                # O post-batch resume token avança mesmo sem eventos relevantes
+                if stream.resume_token is not None:
+                    position = {"resume_token": stream.resume_token}
+                if (
+                    pending >= BATCH_SIZE
+                    or time.monotonic() - last_flush >= FLUSH_SECONDS
+                ):
+                    flush(writers, buffers, position)
+                    if pending:
+                        print(f"[OK] {pending} eventos gravados")
+                    pending, last_flush = 0, time.monotonic()
+            else:
+                # Change streams só morrem após um invalidate
+                needs_baseline = True
+    except KeyboardInterrupt:
+        print("\n[INFO] Encerrando exportador")
+    finally:
+        flush(writers, buffers, position, close=True)
+    return needs_baseline
+
+
+def run():
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    checkpoint = load_checkpoint() or {}
+    committed = checkpoint.get("segments") or {}
+    writers = {name: SegmentWriter(name, committed.get(name)) for name in COLLECTIONS}
+
+    position = stream_position(checkpoint) if checkpoint else baseline(writers)
+    while True:
+        try:
+            if not stream_changes(writers, position):
+                return
+        except OperationFailure as e:
+            if e.code != CHANGE_STREAM_HISTORY_LOST:
+                raise
+            # O oplog já descartou a posição salva: só um novo baseline é seguro
+            print(f"[WARN] Resume token fora do oplog ({e.code}); refazendo baseline")
+        position = baseline(writers)
+
+
+def main():
+    print(f"Conectando em {MONGO_URI}, DB={DB_NAME}, saída={OUTPUT_DIR}")
+    run()
+    print("\n✅ Exportador CDC finalizado; resume token persistido.")
+
+
+if __name__ == "__main__":
+    main()
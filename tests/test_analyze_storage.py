@@ -0,0 +1,97 @@
+from bson import encode
+
+from analyze_storage import (
+    RECORD_ID_BYTES,
+    drop_path,
+    estimate_index_bytes,
+    field_contributions,
+    index_entry_bytes,
+    path_values,
+    simulate_profile,
+)
+
+
+def order(description="Smartphone de última geração", images=("a.jpg", "b.jpg")):
+    return {
+        "order_id": "o-1",
+        "customer_id": "c-1",
+        "items": [
+            {
+                "product_id": "SKU-001",
+                "qty": 1,
+                "product_snapshot": {
+                    "title": "Galaxy",
+                    "description": description,
+                    "images": list(images),
+                },
+            },
+            {
+                "product_id": "SKU-002",
+                "qty": 2,
+                "product_snapshot": {"title": "Nike", "description": description},
+            },
+        ],
+    }
+
+
+def test_field_contributions_top_level_sum_to_document_size():
+    doc = order()
+    fields = field_contributions(doc)
+    top_level = sum(size for path, size in fields.items() if "." not in path)
+    assert top_level + 5 == len(encode(doc))
+
+
+def test_field_contributions_aggregates_array_items_by_path():
+    fields = field_contributions(order(description="x" * 100))
+    # duas linhas de pedido, cada uma com ~100 bytes de description
+    assert fields["items.product_snapshot.description"] > 200
+    assert fields["items.product_snapshot.images"] > 0
+
+
+def test_drop_path_walks_arrays_and_ignores_missing():
+    doc = order()
+    drop_path(doc, ["items", "product_snapshot", "images"])
+    drop_path(doc, ["nao_existe", "campo"])
+    assert all("images" not in i["product_snapshot"] for i in doc["items"])
+    assert doc["items"][0]["product_snapshot"]["title"] == "Galaxy"
+
+
+def test_simulate_profile_reports_bytes_saved_without_mutating_sample():
+    docs = [order(), order(description=None, images=())]
+    paths = ["items.product_snapshot.description", "items.product_snapshot.images"]
+    saved = simulate_profile(docs, paths)
+    assert saved > 0
+    assert "description" in docs[0]["items"][0]["product_snapshot"]
+    assert simulate_profile([], paths) == 0
+
+
+def test_path_values_multikey_and_missing():
+    doc = order()
+    assert path_values(doc, ["items", "product_id"]) == ["SKU-001", "SKU-002"]
+    assert path_values(doc, ["status"]) == [None]
+    assert path_values({"tags": []}, ["tags"]) == [None]
+
+
+def test_index_estimate_is_per_key_not_per_file():
+    indexes = {
+        "_id_": {"key": [("_id", 1)]},
+        "ix_items_product": {"key": [("items.product_id", 1)]},
+        "ix_customer_created": {"key": [("customer_id", 1), ("created_at", 1)]},
+    }
+    doc = order()
+    # multikey: uma entrada por linha do pedido
+    assert index_entry_bytes(doc, indexes["ix_items_product"]) == 2 * (
+        len(encode({"": "SKU-001"})) - 5 + RECORD_ID_BYTES
+    )
+    per_doc = estimate_index_bytes([doc, doc], indexes)
+    assert set(per_doc) == set(indexes)
+    # algumas dezenas de bytes por documento, nunca KB de overhead de arquivo
+    assert 0 < sum(per_doc.values()) < 200
+
+
+def test_text_index_estimate_counts_unique_terms():
+    index = {"key": [("_fts", "text"), ("_ftsx", 1)], "weights": {"title": 1}}
+    assert index_entry_bytes({"title": "Tênis tênis Nike"}, index) > 0
+    assert index_entry_bytes({"title": "a a a"}, index) == index_entry_bytes(
+        {"title": "a"}, index
+    )
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import async_dal
+
+
+def test_batched_splits_and_keeps_remainder():
+    assert list(async_dal.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(async_dal.batched([], 2)) == []
+
+
+def test_gather_bounded_limits_in_flight_and_keeps_order():
+    in_flight, peak = 0, 0
+
+    async def work(i):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return i
+
+    async def main():
+        return await async_dal.gather_bounded((work(i) for i in range(20)), 3)
+
+    assert asyncio.run(main()) == list(range(20))
+    assert peak == 3
+
+
+def test_client_is_created_per_event_loop():
+    async def clients():
+        first, second = async_dal.get_client(), async_dal.get_client()
+        await async_dal.close_client()
+        return first, second
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    # um loop novo (p.ex. um teste novo do pytest-asyncio) ganha outro cliente
+    other, _ = asyncio.run(clients())
+    assert other is not first
+
+
+def test_close_client_allows_reuse_in_same_loop():
+    async def main():
+        first = async_dal.get_client()
+        await async_dal.close_client()
+        second = async_dal.get_client()
+        await async_dal.close_client()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first is not second
+
+
+def test_init_client_applies_options():
+    async def main():
+        client = async_dal.init_client(maxPoolSize=7)
+        assert async_dal.get_client() is client
+        assert async_dal.get_db().name == async_dal.DB_NAME
+        assert client.options.pool_options.max_pool_size == 7
+        await async_dal.close_client()
+
+    asyncio.run(main())
+
+
+def test_init_client_refuses_to_replace_a_live_client():
+    async def main():
+        client = async_dal.get_client()
+        with pytest.raises(RuntimeError, match="close_client"):
+            async_dal.init_client()
+        assert async_dal.get_client() is client
+        await async_dal.close_client()
+        assert async_dal.init_client() is not client
+        await async_dal.close_client()
+
+    asyncio.run(main())
@@ -0,0 +1,343 @@
+import gzip
+import os
+
+import pytest
+from bson import json_util
+from pymongo.errors import OperationFailure
+
+import cdc_compact
+import cdc_export
+
+
+@pytest.fixture(autouse=True)
+def output_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cdc_export, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(cdc_compact, "OUTPUT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def event(op, key, doc=None):
+    record = {"coll": "orders", "op": op, "ts": None}
+    if key is not None:
+        record["key"] = key
+        record["doc"] = doc
+    return cdc_export.to_line(record)
+
+
+def upsert(key, **fields):
+    return event("insert", key, {"_id": key, **fields})
+
+
+def write_segment(writer, *batches):
+    for batch in batches:
+        writer.append(list(batch))
+    writer.rotate()
+
+
+def snapshot():
+    return {doc["_id"]: doc for doc in cdc_compact.iter_snapshot("orders")}
+
+
+def segments(directory):
+    return sorted(os.listdir(directory / "orders"))
+
+
+def test_writer_rotates_by_size(output_dir, monkeypatch):
+    monkeypatch.setattr(cdc_export, "MAX_SEGMENT_BYTES", 1)
+    writer = cdc_export.SegmentWriter("orders")
+    assert not writer.should_rotate()
+    writer.append([upsert("o-1")])
+    assert writer.should_rotate()
+    writer.rotate()
+    [name] = segments(output_dir)
+    assert name.endswith(".ndjson.gz")
+    assert writer.state() is None
+
+
+def test_writer_truncates_torn_tail_to_committed_offset(output_dir):
+    writer = cdc_export.SegmentWriter("orders")
+    writer.append([upsert("o-1", status="PLACED")])
+    committed = writer.state()
+    writer.append([upsert("o-2")])
+    # queda no meio da gravação: metade de um membro gzip no fim do .part
+    torn = gzip.compress(upsert("o-3"))
+    with open(writer.path, "ab") as f:
+        f.write(torn[: len(torn) // 2])
+
+    writer = cdc_export.SegmentWriter("orders", committed)
+    assert os.path.getsize(writer.path) == committed["offset"]
+    write_segment(writer, [upsert("o-1", status="PAID")])
+
+    cdc_compact.compact_collection("orders")
+    assert snapshot() == {"o-1": {"_id": "o-1", "status": "PAID"}}
+
+
+def test_writer_discards_uncommitted_part(output_dir):
+    writer = cdc_export.SegmentWriter("orders")
+    writer.append([upsert("o-1")])
+    cdc_export.SegmentWriter("orders", None)
+    assert segments(output_dir) == []
+
+
+def test_compaction_skips_corrupt_tail(output_dir, capsys):
+    writer = cdc_export.SegmentWriter("orders")
+    writer.append([upsert("o-1")])
+    with open(writer.path, "ab") as f:
+        f.write(gzip.compress(upsert("o-2"))[:10])
+    writer.rotate()
+
+    cdc_compact.compact_collection("orders")
+    assert set(snapshot()) == {"o-1"}
+    assert "corrompido" in capsys.readouterr().out
+
+
+def test_iter_members_reports_offset_of_torn_member(output_dir):
+    path = output_dir / "seg.gz"
+    good = gzip.compress(b"a\n")
+    path.write_bytes(good + gzip.compress(b"b\n")[:5])
+    members = cdc_compact.iter_members(str(path))
+    assert next(members) == (len(good), b"a\n")
+    with pytest.raises(cdc_compact.CorruptSegment) as e:
+        next(members)
+    assert e.value.offset == len(good)
+
+
+def test_repeated_baseline_drops_ghosts(output_dir):
+    writer = cdc_export.SegmentWriter("orders")
+    baseline = event("baseline_start", None)
+    write_segment(writer, [baseline, upsert("o-1"), upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    # o-2 foi removido sem evento de delete antes do novo baseline
+    write_segment(writer, [baseline, upsert("o-1")], [upsert("o-3")])
+    cdc_compact.compact_collection("orders")
+    assert set(snapshot()) == {"o-1", "o-3"}
+
+
+def test_baseline_inside_pending_segments_discards_earlier_events(output_dir):
+    writer = cdc_export.SegmentWriter("orders")
+    write_segment(writer, [upsert("o-1"), upsert("o-2")])
+    write_segment(writer, [event("baseline_start", None), upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    assert set(snapshot()) == {"o-2"}
+
+
+def test_deltas_merge_and_rebuild_base(output_dir, monkeypatch):
+    monkeypatch.setattr(cdc_compact, "MAX_DELTAS", 2)
+    writer = cdc_export.SegmentWriter("orders")
+    write_segment(writer, [upsert("o-1"), upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    write_segment(writer, [event("delete", "o-1"), upsert("o-2", status="PAID")])
+    cdc_compact.compact_collection("orders")
+    manifest = cdc_compact.load_manifest("orders")
+    assert len(manifest["deltas"]) == 2
+    assert snapshot() == {"o-2": {"_id": "o-2", "status": "PAID"}}
+
+    write_segment(writer, [upsert("o-3")])
+    cdc_compact.compact_collection("orders")
+    manifest = cdc_compact.load_manifest("orders")
+    assert manifest["deltas"] == [] and manifest["base"]
+    assert set(snapshot()) == {"o-2", "o-3"}
+    files = os.listdir(cdc_compact.snapshot_dir("orders"))
+    assert sorted(files) == sorted([manifest["base"], "manifest.json"])
+
+
+def test_replayed_events_after_crash_are_idempotent(output_dir):
+    # queda entre rotação e checkpoint: o stream reenvia os mesmos eventos
+    writer = cdc_export.SegmentWriter("orders")
+    batch = [upsert("o-1"), event("delete", "o-1"), upsert("o-2", status="PAID")]
+    write_segment(writer, batch)
+    cdc_compact.compact_collection("orders")
+    write_segment(writer, batch)
+    cdc_compact.compact_collection("orders")
+    assert snapshot() == {"o-2": {"_id": "o-2", "status": "PAID"}}
+
+
+def test_flush_checkpoints_offsets_after_data(output_dir):
+    writers = {"orders": cdc_export.SegmentWriter("orders")}
+    cdc_export.flush(
+        writers, {"orders": [upsert("o-1")]}, {"resume_token": {"_data": "1"}}
+    )
+    checkpoint = cdc_export.load_checkpoint()
+    assert checkpoint["resume_token"] == {"_data": "1"}
+    assert checkpoint["segments"]["orders"] == writers["orders"].state()
+    assert cdc_export.stream_position(checkpoint) == {"resume_token": {"_data": "1"}}
+
+
+def test_run_rebaselines_when_history_is_lost(output_dir, monkeypatch):
+    cdc_export.save_checkpoint({"resume_token": {"_data": "old"}}, {})
+    calls = []
+
+    def fake_stream(writers, position):
+        calls.append(position)
+        if len(calls) == 1:
+            raise OperationFailure("history lost", code=286)
+
+    monkeypatch.setattr(cdc_export, "stream_changes", fake_stream)
+    monkeypatch.setattr(
+        cdc_export, "baseline", lambda writers: {"start_at_operation_time": "t"}
+    )
+    cdc_export.run()
+    assert calls == [
+        {"resume_token": {"_data": "old"}},
+        {"start_at_operation_time": "t"},
+    ]
+
+
+def test_run_propagates_other_failures(output_dir, monkeypatch):
+    cdc_export.save_checkpoint({"resume_token": {"_data": "old"}}, {})
+
+    def fake_stream(writers, position):
+        raise OperationFailure("boom", code=13)
+
+    monkeypatch.setattr(cdc_export, "stream_changes", fake_stream)
+    with pytest.raises(OperationFailure):
+        cdc_export.run()
+
+
+def test_truncated_base_fails_with_rebaseline_hint(output_dir, monkeypatch):
+    monkeypatch.setattr(cdc_compact, "MAX_DELTAS", 0)
+    writer = cdc_export.SegmentWriter("orders")
+    write_segment(writer, [upsert("o-1"), upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    base = os.path.join(
+        cdc_compact.snapshot_dir("orders"), cdc_compact.load_manifest("orders")["base"]
+    )
+    with open(base, "r+b") as f:
+        f.truncate(os.path.getsize(base) // 2)
+
+    with pytest.raises(cdc_compact.CorruptSnapshot, match="Refaça o baseline"):
+        list(cdc_compact.iter_snapshot("orders"))
+    write_segment(writer, [upsert("o-3")])
+    with pytest.raises(cdc_compact.CorruptSnapshot):
+        cdc_compact.compact_collection("orders")
+
+
+def test_new_baseline_replaces_corrupt_base(output_dir, monkeypatch):
+    monkeypatch.setattr(cdc_compact, "MAX_DELTAS", 0)
+    writer = cdc_export.SegmentWriter("orders")
+    write_segment(writer, [upsert("o-1")])
+    cdc_compact.compact_collection("orders")
+    base = os.path.join(
+        cdc_compact.snapshot_dir("orders"), cdc_compact.load_manifest("orders")["base"]
+    )
+    with open(base, "r+b") as f:
+        f.truncate(5)
+
+    write_segment(writer, [event("baseline_start", None), upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    assert set(snapshot()) == {"o-2"}
+
+
+def change(op, coll="orders", **extra):
+    return {
+        "operationType": op,
+        "ns": {"db": "db", "coll": coll},
+        "clusterTime": None,
+        **extra,
+    }
+
+
+def test_drop_writes_collection_reset(output_dir):
+    buffers = {"orders": [], "carts": []}
+    assert not cdc_export.handle_change(change("drop"), buffers)
+    writer = cdc_export.SegmentWriter("orders")
+    write_segment(writer, [upsert("o-1")], buffers["orders"], [upsert("o-2")])
+    cdc_compact.compact_collection("orders")
+    assert set(snapshot()) == {"o-2"}
+
+
+def test_rename_resets_source_and_rebaselines_target():
+    buffers = {"orders": [], "carts": []}
+    rename_out = change("rename", to={"db": "db", "coll": "orders_old"})
+    assert not cdc_export.handle_change(rename_out, buffers)
+    assert b"collection_reset" in buffers["orders"][0]
+
+    rename_in = change("rename", coll="orders_tmp", to={"db": "db", "coll": "carts"})
+    assert cdc_export.handle_change(rename_in, buffers)
+    assert cdc_export.handle_change({"operationType": "invalidate"}, buffers)
+
+
+class FakeStream:
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+        self.resume_token = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def try_next(self):
+        item = self.changes.pop(0)
+        self.resume_token = {"_data": item["operationType"]}
+        if item["operationType"] == "invalidate":
+            self.alive = False
+        return item
+
+
+class FakeDb:
+    def __init__(self, changes):
+        self.changes = changes
+
+    def watch(self, pipeline, **options):
+        return FakeStream(self.changes)
+
+
+def test_invalidate_does_not_checkpoint_its_token(output_dir, monkeypatch):
+    insert = change("insert", documentKey={"_id": "o-1"}, fullDocument={"_id": "o-1"})
+    monkeypatch.setattr(
+        cdc_export, "db", FakeDb([insert, {"operationType": "invalidate"}])
+    )
+    writers = {name: cdc_export.SegmentWriter(name) for name in cdc_export.COLLECTIONS}
+    assert cdc_export.stream_changes(writers, {"start_at_operation_time": "t"})
+    assert cdc_export.load_checkpoint()["resume_token"] == {"_data": "insert"}
+    [name] = segments(output_dir)
+    assert name.endswith(".ndjson.gz")
+
+
+def test_run_rebaselines_after_invalidate(output_dir, monkeypatch):
+    cdc_export.save_checkpoint({"resume_token": {"_data": "old"}}, {})
+    results = [True, False]
+    calls = []
+
+    def fake_stream(writers, position):
+        calls.append(position)
+        return results.pop(0)
+
+    monkeypatch.setattr(cdc_export, "stream_changes", fake_stream)
+    monkeypatch.setattr(
+        cdc_export, "baseline", lambda writers: {"start_at_operation_time": "t"}
+    )
+    cdc_export.run()
+    assert calls == [
+        {"resume_token": {"_data": "old"}},
+        {"start_at_operation_time": "t"},
+    ]
+
+
+def test_baseline_fold_spills_sorted_runs(output_dir, monkeypatch):
+    monkeypatch.setattr(cdc_compact, "RUN_SIZE", 2)
+    sizes = []
+    write_run = cdc_compact.write_run
+
+    def spy(name, changes):
+        sizes.append(len(changes))
+        return write_run(name, changes)
+
+    monkeypatch.setattr(cdc_compact, "write_run", spy)
+    writer = cdc_export.SegmentWriter("orders")
+    docs = [upsert(f"o-{i}") for i in (5, 3, 1, 4, 2)]
+    write_segment(
+        writer,
+        [event("baseline_start", None), *docs],
+        [event("delete", "o-3"), upsert("o-5", status="PAID")],
+    )
+    cdc_compact.compact_collection("orders")
+
+    assert max(sizes) <= 2 and len(sizes) > 1
+    assert list(snapshot()) == ["o-1", "o-2", "o-4", "o-5"]
+    assert snapshot()["o-5"] == {"_id": "o-5", "status": "PAID"}
+    files = os.listdir(cdc_compact.snapshot_dir("orders"))
+    assert not [f for f in files if f.startswith("run-")]